@@ -2,28 +2,84 @@
 Provides functions to sync folder to replica.
 """
 
+import errno
 import logging
-from collections import deque
-from hashlib import md5
+import mmap
+import os
+import sys
+import threading
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from enum import Enum, auto
+from functools import partial
 from pathlib import Path
-from shutil import copy2, copytree, rmtree
+from shutil import copyfile, copystat
+from stat import S_IFDIR, S_IFMT, S_IMODE, S_ISDIR, S_ISLNK, S_ISREG
 from time import sleep
 from timeit import default_timer
-from typing import Literal, TypeAlias
+from typing import Any, Literal, NamedTuple, TypeAlias
 
 import click
 
+_hasher: Callable[..., Any]
+try:
+    from blake3 import blake3
+
+    # blake3 splits large inputs across threads, small ones are hashed on the calling thread
+    _hasher = partial(blake3, max_threads=blake3.AUTO)
+    HASHER_READS_FILES: bool = True
+except ImportError:  # pragma: no cover
+    from hashlib import blake2b
+
+    _hasher = blake2b
+    HASHER_READS_FILES = False
+
+if sys.platform == "win32":  # pragma: no cover
+    import ctypes
+    from ctypes import wintypes
+
+    # CopyFileExW lets Windows copy the file in the kernel (or offload it to the storage) like copy_file_range on Linux
+    _copy_file_ex = ctypes.WinDLL("kernel32", use_last_error=True).CopyFileExW
+    _copy_file_ex.argtypes = [wintypes.LPCWSTR, wintypes.LPCWSTR, wintypes.LPVOID, wintypes.LPVOID, wintypes.LPBOOL, wintypes.DWORD]
+    _copy_file_ex.restype = wintypes.BOOL
+
 __author__ = "George Murga"
 __copyright__ = "George Murga"
 __license__ = "MIT"
 
 _logger: logging.Logger = logging.getLogger(__name__)
+_thread_local: threading.local = threading.local()
+_formatter: logging.Formatter = logging.Formatter(
+    fmt="[%(asctime)s.%(msecs)03d] %(levelname)s:%(name)s:- %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+)
 
 
 LOGLEVEL: TypeAlias = Literal["debug", "info", "warn", "error", "critical"]
+SnapshotEntry: TypeAlias = tuple[int, int, int]
+
+HASH_BUFFER_SIZE: int = 1 << 20
+MMAP_HASH_LIMIT: int = 1 << 31
+COPY_BLOCK_SIZE: int = 1 << 30
+COMPARE_BLOCK_SIZE: int = 1 << 20
+DEFAULT_WORKERS: int = min(32, (os.cpu_count() or 1) * 4)
+_NOT_IN_SNAPSHOT: SnapshotEntry = (0, 0, 0)
+_FOLDER_ENTRY: SnapshotEntry = (S_IFDIR, 0, 0)
+
 
+class ReplicaStatus(Enum):
+    """State of the replica entry at the same relative path as a source entry."""
 
-def sync_folder(source: Path, replica: Path, syncinterval: int, logfile: Path, loglevel: LOGLEVEL) -> None:
+    MISSING = auto()
+    SAME = auto()
+    MODIFIED = auto()
+    FILE_IS_A_FOLDER = auto()
+    FOLDER_IS_A_FILE = auto()
+    OTHER_TYPE = auto()
+
+
+def sync_folder(
+    source: Path, replica: Path, syncinterval: int, logfile: Path, loglevel: LOGLEVEL, workers: int = DEFAULT_WORKERS
+) -> None:
     """Synchronizes SOURCE folder to REPLICA folder.
 
     Args:
@@ -32,6 +88,7 @@ def sync_folder(source: Path, replica: Path, syncinterval: int, logfile: Path, l
         syncinterval (int): period with which to repeat the sync in seconds
         logfile (pathlib.Path): path of the logfile
         loglevel (LOGLEVEL): level of the log
+        workers (int): number of threads copying and comparing files
 
     Returns:
         None
@@ -45,60 +102,99 @@ def sync_folder(source: Path, replica: Path, syncinterval: int, logfile: Path, l
     validate_source(source)
     validate_replica(replica)
 
-    _logger.info("Starting sync every %s seconds. SOURCE: %s -> REPLICA: %s" % (syncinterval, source.resolve(), replica.resolve()))
+    source_str: str = str(source)
+    replica_str: str = str(replica)
+    _logger.info("Starting sync every %s seconds. SOURCE: %s -> REPLICA: %s", syncinterval, source_str, replica_str)
     try:
         while True:
-            _logger.info("Syncing round %d (every %d seconds)" % (sync_count, syncinterval))
+            _logger.info("Syncing round %d (every %d seconds)", sync_count, syncinterval)
 
             start_time: float = default_timer()
 
-            files_count: int = 0
-            folders_count: int = 0
-            files_copied: int = 0
-            files_updated: int = 0
-            folders_copied: int = 0
-            files_deleted: int = 0
-            folders_deleted: int = 0
-            folders_deleted1: int = 0
-            folders_deleted2: int = 0
-            files_count, folders_count, files_copied, files_updated, folders_copied, folders_deleted1 = sync_source_to_replica(
-                source, replica
-            )
-            files_deleted, folders_deleted2 = sync_replica_to_source(source, replica)
-            folders_deleted = folders_deleted1 + folders_deleted2
+            (
+                files_count,
+                folders_count,
+                files_copied,
+                files_updated,
+                folders_copied,
+                files_deleted,
+                folders_deleted,
+            ) = sync_trees(source, replica, workers)
             _logger.info(
                 "processed: total files = %d, total folders = %d, files copied = %d, files_updated = %d, folders_copied = %d, "
-                "files_deleted = %d, folders_deleted = %d"
-                % (files_count, folders_count, files_copied, files_updated, folders_copied, files_deleted, folders_deleted)
+                "files_deleted = %d, folders_deleted = %d",
+                files_count,
+                folders_count,
+                files_copied,
+                files_updated,
+                folders_copied,
+                files_deleted,
+                folders_deleted,
             )
             if syncinterval == 0:
                 break
-            end_time: float = default_timer()
             _logger.info("Waiting for next sync round...")
-            while True:
-                if end_time - start_time < syncinterval:
-                    sleep(1)
-                    end_time = default_timer()
-                else:
-                    break
+            remaining: float = syncinterval - (default_timer() - start_time)
+            if remaining > 0:
+                sleep(remaining)
             sync_count += 1
     except KeyboardInterrupt:
         _logger.warn("Sync interrupted by keyboard")
     except FileNotFoundError as e:
         _logger.exception(e, exc_info=True)
-    except ExpectedFileIsAFolder as e:
-        _logger.exception(e, exc_info=True)
     except PermissionError as e:
         _logger.exception(e, exc_info=True)
     finally:
         _logger.info("Syncing stopped.")
 
 
-def sync_source_to_replica(source: Path, replica: Path) -> tuple[int, int, int, int, int, int]:
+def sync_trees(source: Path, replica: Path, workers: int = DEFAULT_WORKERS) -> tuple[int, int, int, int, int, int, int]:
+    """Make replica match source.
+    Both folders are scanned once, the snapshots are compared and the resulting plan is executed:
+    the replica files and folders not in source are deleted, then the missing and modified ones are copied.
+    Symlinks are not followed, they are copied as symlinks and counted as files.
+
+    Args:
+        source (pathlib.Path): path of the source folder
+        replica (pathlib.Path): path of the target folder
+        workers (int): number of threads copying and comparing files
+    Returns:
+        Tuple[int, int, int, int, int, int, int]:
+            files_count - how many files were processed,
+            folders_count - how many folders were processed,
+            files_copied - how many files were copied to the replica,
+            files_updated - how many files were updated in the replica,
+            folders_copied - how many folders were copied to the replica,
+            files_deleted - how many files were deleted from the replica,
+            folders_deleted - how many folders were deleted from the replica.
+    """
+    source_str: str = str(source)
+    replica_str: str = str(replica)
+    source_stats: dict[str, os.stat_result] = {}
+    plan: SyncPlan = _diff(_snapshot(source_str, source_stats), _snapshot(replica_str))
+    files_deleted, folders_deleted1 = _delete_extras(plan.delete_files, plan.delete_folders, plan.delete_content, replica_str)
+    files_copied, files_updated, folders_copied, folders_deleted2 = _copy_to_replica(
+        plan, source_str, replica_str, workers, source_stats
+    )
+    return (
+        plan.files_count,
+        plan.folders_count,
+        files_copied,
+        files_updated,
+        folders_copied,
+        files_deleted,
+        folders_deleted1 + folders_deleted2,
+    )
+
+
+def sync_source_to_replica(source: Path, replica: Path, workers: int = DEFAULT_WORKERS) -> tuple[int, int, int, int, int, int]:
     """Sync source contents to replica.
+    Folders missing from the replica are copied whole, so their content is not counted as processed.
+
     Args:
         source (pathlib.Path): path of the source folder
         replica (pathlib.Path): path of the target folder
+        workers (int): number of threads copying and comparing files
     Returns:
         Tuple[int, int, int, int]:
             files_count - how many files were processed,
@@ -106,66 +202,14 @@ def sync_source_to_replica(source: Path, replica: Path) -> tuple[int, int, int,
             files_copied - how many files were copied to the replica,
             folders_copied - how many folders were copied to the replica.
     """
-    _logging: logging.Logger = logging.getLogger(__name__)
-    files_count: int = 0
-    folders_count: int = 0
-    files_copied: int = 0
-    files_updated: int = 0
-    folders_copied: int = 0
-    folders_deleted: int = 0
-    folder_queue: deque = deque()
-    folder_queue.append(source)
-    _logging.debug("added source folder to queue: %s" % source.as_posix())
-    while len(folder_queue) > 0:
-        current_folder: Path = folder_queue.popleft()
-        for el in current_folder.glob("*"):
-            if el.is_file():
-                _logging.debug("processing file: %s" % el.as_posix())
-                files_count += 1
-                if is_file_in_other_as_folder(el, source, replica):
-                    replica_folder: Path = replica / (el.as_posix().replace(source.as_posix(), "").lstrip("/"))
-                    replica_folder.rmdir()
-                    _logging.info("deleted folder %s" % replica_folder.as_posix())
-                    folders_deleted += 1
-                if is_file_in_other(el, source, replica):
-                    if is_file_in_other_modified(el, source, replica):
-                        replica_file: Path = Path(
-                            copy2(
-                                el,
-                                replica / (el.as_posix().replace(source.as_posix(), "").lstrip("/")),
-                            )
-                        )
-                        _logging.info("updated file %s to %s" % (el.as_posix(), replica_file.as_posix()))
-                        files_updated += 1
-                else:
-                    replica_file = Path(
-                        copy2(
-                            el,
-                            replica / (el.as_posix().replace(source.as_posix(), "").lstrip("/")),
-                        )
-                    )
-                    _logging.info("copied file %s to %s" % (el.as_posix(), replica_file.as_posix()))
-                    files_copied += 1
-            elif el.is_dir():
-                folders_count += 1
-                if is_folder_in_other_as_folder(el, source, replica):
-                    folder_queue.append(el)
-                    _logging.debug("added to queue: %s" % el.as_posix())
-                else:
-                    if is_folder_in_other_as_file(el, source, replica):
-                        replica_file = Path(
-                            copy2(
-                                el,
-                                replica / (el.as_posix().replace(source.as_posix(), "").lstrip("/")),
-                            )
-                        )
-                        replica_file.unlink()
-                        _logging.info("deleted file %s" % replica_file.as_posix())
-                    destination_folder = Path(el.as_posix().replace(source.as_posix(), replica.as_posix()))
-                    replica_folder = Path(copytree(el, destination_folder))
-                    _logging.info("copied whole folder to replica %s" % replica_folder.as_posix())
-                    folders_copied += 1
-    return files_count, folders_count, files_copied, files_updated, folders_copied, folders_deleted
+    source_str: str = str(source)
+    replica_str: str = str(replica)
+    source_stats: dict[str, os.stat_result] = {}
+    plan: SyncPlan = _diff(_snapshot(source_str, source_stats), _snapshot(replica_str))
+    files_copied, files_updated, folders_copied, folders_deleted = _copy_to_replica(
+        plan, source_str, replica_str, workers, source_stats
+    )
+    return plan.files_count, plan.folders_count, files_copied, files_updated, folders_copied, folders_deleted
 
 
 def sync_replica_to_source(source: Path, replica: Path) -> tuple[int, int]:
@@ -178,29 +222,357 @@ def sync_replica_to_source(source: Path, replica: Path) -> tuple[int, int]:
             files_deleted - how many files were deleted,
             folders_deleted - how many folders were deleted,
     """
-    _logging: logging.Logger = logging.getLogger(__name__)
-    files_deleted: int = 0
-    folders_deleted: int = 0
-    folder_queue: deque = deque()
-    folder_queue.append(replica)
-    _logging.debug("added replica to folder queue: %s" % replica.as_posix())
-    while len(folder_queue) > 0:
-        current_folder: Path = folder_queue.popleft()
-        for el in current_folder.glob("*"):
-            if el.is_file():
-                _logging.debug("processing file: %s" % el.as_posix())
-                if not is_file_in_other(el, replica, source):
-                    el.unlink()
-                    _logger.info("deleted file from replica: %s" % el.as_posix())
-                    files_deleted += 1
-            elif el.is_dir():
-                if is_folder_in_other_as_folder(el, replica, source):
-                    pass
+    replica_str: str = str(replica)
+    delete_files, delete_folders, delete_content, _ = _extras(_snapshot(str(source)), _snapshot(replica_str))
+    return _delete_extras(delete_files, delete_folders, delete_content, replica_str)
+
+
+class SyncPlan(NamedTuple):
+    """What has to be done to make the replica match the source, as relative paths."""
+
+    copy_files: list[str]
+    copy_folders: list[str]
+    copy_links: list[str]
+    copy_content: list[tuple[str, int]]
+    update_files: list[tuple[str, SnapshotEntry]]
+    replaced_files: list[str]
+    replaced_folders: list[str]
+    replaced_content: list[tuple[str, int]]
+    delete_files: list[str]
+    delete_folders: list[str]
+    delete_content: list[tuple[str, int]]
+    files_count: int
+    folders_count: int
+
+
+def _diff(source_snapshot: dict[str, SnapshotEntry], replica_snapshot: dict[str, SnapshotEntry]) -> SyncPlan:
+    """Compare the snapshots of source and replica.
+    Snapshots list folders before their content (as _snapshot does), which lets the content of folders copied,
+    replaced or deleted whole be collected without comparing it, so these folders don't have to be listed again.
+
+    Args:
+        source_snapshot (dict[str, SnapshotEntry]): snapshot of the source folder
+        replica_snapshot (dict[str, SnapshotEntry]): snapshot of the replica folder
+
+    Returns:
+        SyncPlan: copy_files / copy_folders / copy_links - missing from the replica or replaced,
+        update_files - files with different size or modification time, with their replica snapshot,
+        replaced_files / replaced_folders - replica entries with another type than in source and modified symlinks,
+        delete_files / delete_folders - replica entries not in source,
+        copy_content / replaced_content / delete_content - (path, st_mode) of the entries inside copy_folders,
+        replaced_folders and delete_folders, parents first,
+        files_count / folders_count - how many source files (symlinks included) and folders were compared
+    """
+    plan: SyncPlan = SyncPlan([], [], [], [], [], [], [], [], [], [], [], 0, 0)
+    files_count: int = 0
+    folders_count: int = 0
+    debug: bool = _logger.isEnabledFor(logging.DEBUG)
+    dirname = os.path.dirname
+    get_replica_entry = replica_snapshot.get
+    copied_folders: set[str] = set()
+    for path, source_entry in source_snapshot.items():
+        if copied_folders and dirname(path) in copied_folders:
+            if S_ISDIR(source_entry[0]):
+                copied_folders.add(path)
+            plan.copy_content.append((path, source_entry[0]))
+            continue
+        replica_entry: SnapshotEntry | None = get_replica_entry(path)
+        if replica_entry == source_entry:
+            # same type, size and modification time: nothing to do, the common case once the replica is in sync
+            if S_ISREG(source_entry[0]) or S_ISLNK(source_entry[0]):
+                files_count += 1
+            elif S_ISDIR(source_entry[0]):
+                folders_count += 1
+            continue
+        status: ReplicaStatus = replica_status(source_entry, replica_entry)
+        if S_ISREG(source_entry[0]) or S_ISLNK(source_entry[0]):
+            if debug:
+                _logger.debug("processing file: %s", path)
+            files_count += 1
+            copy_list: list[str] = plan.copy_files if S_ISREG(source_entry[0]) else plan.copy_links
+            if status is ReplicaStatus.FILE_IS_A_FOLDER:
+                plan.replaced_folders.append(path)
+                copy_list.append(path)
+            elif status is ReplicaStatus.MISSING:
+                copy_list.append(path)
+            elif status is ReplicaStatus.OTHER_TYPE or (status is ReplicaStatus.MODIFIED and S_ISLNK(source_entry[0])):
+                # symlinks are cheap to recreate, a modified one is replaced instead of compared
+                plan.replaced_files.append(path)
+                copy_list.append(path)
+            elif status is ReplicaStatus.MODIFIED:
+                plan.update_files.append((path, replica_entry))  # type: ignore
+        elif S_ISDIR(source_entry[0]):
+            folders_count += 1
+            if status is not ReplicaStatus.SAME:
+                if status is ReplicaStatus.FOLDER_IS_A_FILE:
+                    plan.replaced_files.append(path)
+                plan.copy_folders.append(path)
+                copied_folders.add(path)
+    delete_files, delete_folders, delete_content, replaced_content = _extras(source_snapshot, replica_snapshot)
+    return plan._replace(
+        replaced_content=replaced_content,
+        delete_files=delete_files,
+        delete_folders=delete_folders,
+        delete_content=delete_content,
+        files_count=files_count,
+        folders_count=folders_count,
+    )
+
+
+def _extras(
+    source_snapshot: dict[str, SnapshotEntry], replica_snapshot: dict[str, SnapshotEntry]
+) -> tuple[list[str], list[str], list[tuple[str, int]], list[tuple[str, int]]]:
+    """Return the replica files and folders not in source, as relative paths, in one pass over the replica snapshot.
+    The content of a folder to delete isn't compared, it's returned separately to be deleted with the folder.
+    Replica entries which have another type in source aren't returned, they are replaced when copying,
+    but the content of the replaced folders is returned too.
+
+    Returns:
+        Tuple[list[str], list[str], list[tuple[str, int]], list[tuple[str, int]]]: delete_files, delete_folders,
+        delete_content and replaced_content as (path, st_mode), parents first
+    """
+    delete_files: list[str] = []
+    delete_folders: list[str] = []
+    delete_content: list[tuple[str, int]] = []
+    replaced_content: list[tuple[str, int]] = []
+    dirname = os.path.dirname
+    get_source_entry = source_snapshot.get
+    # folders deleted or replaced whole and the list their content goes to
+    removed_folders: dict[str, list[tuple[str, int]]] = {}
+    for path, replica_entry in replica_snapshot.items():
+        if removed_folders:
+            content: list[tuple[str, int]] | None = removed_folders.get(dirname(path))
+            if content is not None:
+                content.append((path, replica_entry[0]))
+                if S_ISDIR(replica_entry[0]):
+                    removed_folders[path] = content
+                continue
+        source_mode: int = get_source_entry(path, _NOT_IN_SNAPSHOT)[0]
+        if S_ISDIR(replica_entry[0]):
+            if not S_ISDIR(source_mode):
+                if not S_ISREG(source_mode) and not S_ISLNK(source_mode):
+                    delete_folders.append(path)
+                    removed_folders[path] = delete_content
                 else:
-                    rmtree(el)
-                    _logger.info("deleted folder from replica: %s" % el.as_posix())
-                    folders_deleted += 1
-    return files_deleted, folders_deleted
+                    removed_folders[path] = replaced_content
+        elif not S_ISREG(source_mode) and not S_ISDIR(source_mode) and not S_ISLNK(source_mode):
+            delete_files.append(path)
+    return delete_files, delete_folders, delete_content, replaced_content
+
+
+def _delete_extras(
+    delete_files: list[str], delete_folders: list[str], delete_content: list[tuple[str, int]], replica: str
+) -> tuple[int, int]:
+    """Delete delete_files then delete_folders (with their delete_content) from replica and return how many were deleted."""
+    for path in delete_files:
+        replica_path: str = os.path.join(replica, path)
+        os.unlink(replica_path)
+        _logger.info("deleted file from replica: %s", replica_path)
+    _remove_folders(delete_folders, delete_content, replica)
+    for path in delete_folders:
+        _logger.info("deleted folder from replica: %s", os.path.join(replica, path))
+    return len(delete_files), len(delete_folders)
+
+
+def _remove_folders(folders: list[str], content: list[tuple[str, int]], replica: str) -> None:
+    """Delete folders and their content, (path, st_mode) as listed by the replica snapshot, parents first.
+    Files and symlinks are unlinked, then folders are removed deepest first, without listing them again.
+    """
+    for path, mode in content:
+        if not S_ISDIR(mode):
+            os.unlink(os.path.join(replica, path))
+    for path, mode in reversed(content):
+        if S_ISDIR(mode):
+            os.rmdir(os.path.join(replica, path))
+    for path in folders:
+        os.rmdir(os.path.join(replica, path))
+
+
+def _copy_to_replica(
+    plan: SyncPlan, source: str, replica: str, workers: int, source_stats: dict[str, os.stat_result]
+) -> tuple[int, int, int, int]:
+    """Delete the plan's replaced entries from replica, then copy and update files and folders using a pool of threads.
+    The source stats taken by _snapshot are reused instead of calling stat again for every copied file.
+
+    Returns:
+        Tuple[int, int, int, int]: files_copied, files_updated, folders_copied, folders_deleted
+    """
+    for path in plan.replaced_files:
+        replica_path: str = os.path.join(replica, path)
+        os.unlink(replica_path)
+        _logger.info("deleted file %s", replica_path)
+    _remove_folders(plan.replaced_folders, plan.replaced_content, replica)
+    for path in plan.replaced_folders:
+        _logger.info("deleted folder %s", os.path.join(replica, path))
+    # the folders are created first on this thread, parents first, then their files are copied by the pool
+    # with the other files
+    created_folders: list[str] = plan.copy_folders + [path for path, mode in plan.copy_content if S_ISDIR(mode)]
+    for path in created_folders:
+        os.mkdir(os.path.join(replica, path))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        tasks: list[Future[object]] = []
+        for path, mode in plan.copy_content:
+            source_path: str = os.path.join(source, path)
+            if S_ISREG(mode):
+                tasks.append(executor.submit(fast_copy, source_path, os.path.join(replica, path), source_stats[source_path]))
+            elif S_ISLNK(mode):
+                tasks.append(executor.submit(copy_link, source_path, os.path.join(replica, path), source_stats[source_path]))
+        for path in plan.copy_files:
+            source_path = os.path.join(source, path)
+            tasks.append(executor.submit(copy_file, source_path, os.path.join(replica, path), source_stats[source_path]))
+        for path in plan.copy_links:
+            source_path = os.path.join(source, path)
+            tasks.append(executor.submit(copy_link, source_path, os.path.join(replica, path), source_stats[source_path]))
+        update_tasks: list[Future[bool]] = []
+        for path, replica_entry in plan.update_files:
+            source_path = os.path.join(source, path)
+            update_tasks.append(
+                executor.submit(update_file, source_path, os.path.join(replica, path), replica_entry, source_stats[source_path])
+            )
+        for task in as_completed(tasks):
+            task.result()
+        files_updated: int = sum(task.result() for task in as_completed(update_tasks))
+    # folders' times are set once their content is written, deepest first
+    for path in reversed(created_folders):
+        copystat(os.path.join(source, path), os.path.join(replica, path))
+    for path in plan.copy_folders:
+        _logger.info("copied whole folder to replica %s", os.path.join(replica, path))
+    return len(plan.copy_files) + len(plan.copy_links), files_updated, len(plan.copy_folders), len(plan.replaced_folders)
+
+
+def copy_file(source_file: str, replica_file: str, source_stat: os.stat_result | None = None) -> bool:
+    """Copy a source file missing from the replica.
+
+    Args:
+        source_file (str): path of the file in the source folder
+        replica_file (str): path of the file in the replica folder
+        source_stat (os.stat_result | None): already known stat of source_file, stat is called if None
+
+    Returns:
+        bool: True
+    """
+    if source_stat is None:
+        source_stat = os.stat(source_file, follow_symlinks=False)
+    fast_copy(source_file, replica_file, source_stat)
+    _logger.info("copied file %s to %s", source_file, replica_file)
+    return True
+
+
+def copy_link(source_link: str, replica_link: str, source_stat: os.stat_result | None = None) -> bool:
+    """Create a symlink in the replica with the same target as a source symlink.
+    The target is copied as is, it isn't followed nor rewritten. The modification time is copied too where
+    the platform can set it on a symlink, so the next snapshot finds the replica symlink unchanged.
+
+    Args:
+        source_link (str): path of the symlink in the source folder
+        replica_link (str): path of the symlink in the replica folder
+        source_stat (os.stat_result | None): already known lstat of source_link, lstat is called if None
+
+    Returns:
+        bool: True
+    """
+    if source_stat is None:
+        source_stat = os.lstat(source_link)
+    os.symlink(os.readlink(source_link), replica_link, target_is_directory=os.path.isdir(source_link))
+    if os.utime in os.supports_follow_symlinks:
+        os.utime(replica_link, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns), follow_symlinks=False)
+    _logger.info("copied symlink %s to %s", source_link, replica_link)
+    return True
+
+
+def update_file(
+    source_file: str, replica_file: str, replica_entry: SnapshotEntry, source_stat: os.stat_result | None = None
+) -> bool:
+    """Copy a source file over the replica file if its content is different.
+
+    Args:
+        source_file (str): path of the file in the source folder
+        replica_file (str): path of the file in the replica folder
+        replica_entry (SnapshotEntry): snapshot of replica_file
+        source_stat (os.stat_result | None): already known stat of source_file, stat is called if None
+
+    Returns:
+        bool: True if the file was copied, False if the content was the same
+    """
+    if source_stat is None:
+        source_stat = os.stat(source_file, follow_symlinks=False)
+    if not is_modified(source_file, source_stat, replica_file, replica_entry):
+        return False
+    fast_copy(source_file, replica_file, source_stat)
+    _logger.info("updated file %s to %s", source_file, replica_file)
+    return True
+
+
+def _children(path: str) -> Iterator[os.DirEntry]:
+    """Yield the entries of folder path, closing the os.scandir iterator when done."""
+    with os.scandir(path) as it:
+        yield from it
+
+
+def replica_status(source_entry: SnapshotEntry, replica_entry: SnapshotEntry | None) -> ReplicaStatus:
+    """Compare the snapshot of a source file or folder with the snapshot of the same relative path in the replica.
+
+    Args:
+        source_entry (SnapshotEntry): snapshot of the file or folder from the source folder
+        replica_entry (SnapshotEntry | None): snapshot of the replica entry, None if it doesn't exist
+
+    Returns:
+        ReplicaStatus: MISSING if the replica entry doesn't exist,
+        FILE_IS_A_FOLDER / FOLDER_IS_A_FILE if the replica entry has the other type,
+        OTHER_TYPE if neither is a folder but their types differ (e.g. a file and a symlink),
+        MODIFIED if the replica entry has a different size or modification time
+        (for files the content might still be the same, see is_modified),
+        SAME otherwise
+    """
+    if replica_entry is None:
+        return ReplicaStatus.MISSING
+    if S_ISDIR(source_entry[0]):
+        if S_ISDIR(replica_entry[0]):
+            return ReplicaStatus.SAME
+        return ReplicaStatus.FOLDER_IS_A_FILE
+    if S_ISDIR(replica_entry[0]):
+        return ReplicaStatus.FILE_IS_A_FOLDER
+    if S_IFMT(source_entry[0]) != S_IFMT(replica_entry[0]):
+        return ReplicaStatus.OTHER_TYPE
+    if source_entry[1:] != replica_entry[1:]:
+        return ReplicaStatus.MODIFIED
+    return ReplicaStatus.SAME
+
+
+def _snapshot(root: str, stats: dict[str, os.stat_result] | None = None) -> dict[str, SnapshotEntry]:
+    """Return the (mode, size, mtime_ns) of everything inside root (symlinks not followed) keyed by relative path.
+    Folders are listed before their content. The full stats of files and symlinks are also added to stats
+    (keyed by full path) if given.
+    Folders are recognized from the type os.scandir already read and are not stat'ed, their entry is _FOLDER_ENTRY.
+    """
+    snapshot: dict[str, SnapshotEntry] = {}
+    prefix_len: int = len(os.path.join(root, ""))
+    folders: list[str] = [root]
+    while folders:
+        for entry in _children(folders.pop()):
+            if entry.is_dir(follow_symlinks=False):
+                snapshot[entry.path[prefix_len:]] = _FOLDER_ENTRY
+                folders.append(entry.path)
+                continue
+            st: os.stat_result = entry.stat(follow_symlinks=False)
+            snapshot[entry.path[prefix_len:]] = (st.st_mode, st.st_size, st.st_mtime_ns)
+            if stats is not None:
+                stats[entry.path] = st
+    return snapshot
+
+
+def _snapshot_entry(st: os.stat_result) -> SnapshotEntry:
+    return st.st_mode, st.st_size, st.st_mtime_ns
+
+
+def _probe(dest_root: str, rel: str) -> int:
+    """Return the st_mode of rel inside dest_root (symlinks not followed) or 0 if it doesn't exist.
+    A single lstat, it's also 0 when one of rel's parents is a file instead of a folder.
+    """
+    try:
+        return os.lstat(os.path.join(dest_root, rel)).st_mode
+    except (FileNotFoundError, NotADirectoryError):
+        return 0
 
 
 def is_folder_in_other_as_folder(folder_to_check: Path, source: Path, destination: Path) -> bool:
@@ -214,13 +586,7 @@ def is_folder_in_other_as_folder(folder_to_check: Path, source: Path, destinatio
     Returns:
         bool: True if the folder searched is in the destination folder and is a file. False otherwise.
     """
-    glob_str: str = folder_to_check.as_posix().replace(source.as_posix(), "").lstrip("/")
-    potential_matches = list(destination.glob(glob_str))
-    if len(potential_matches) > 0:
-        match_folder: Path = potential_matches[0]
-        if match_folder.is_dir():
-            return True
-    return False
+    return S_ISDIR(_probe(str(destination), os.path.relpath(folder_to_check, source)))
 
 
 def is_folder_in_other_as_file(folder_to_check: Path, source: Path, destination: Path) -> bool:
@@ -234,13 +600,7 @@ def is_folder_in_other_as_file(folder_to_check: Path, source: Path, destination:
     Returns:
         bool: True if the folder searched is in the destination folder but it's a file. False otherwise.
     """
-    glob_str: str = folder_to_check.as_posix().replace(source.as_posix(), "").lstrip("/")
-    potential_matches = list(destination.glob(glob_str))
-    if len(potential_matches) > 0:
-        match_folder: Path = potential_matches[0]
-        if match_folder.is_file():
-            return True
-    return False
+    return S_ISREG(_probe(str(destination), os.path.relpath(folder_to_check, source)))
 
 
 def is_file_in_other_as_folder(file_to_check: Path, source: Path, destination: Path) -> bool:
@@ -254,13 +614,7 @@ def is_file_in_other_as_folder(file_to_check: Path, source: Path, destination: P
     Returns:
         bool: True if the file is found in the destination and is a folder. False otherwise
     """
-    glob_str: str = file_to_check.as_posix().replace(source.as_posix(), "").lstrip("/")
-    potential_matches = list(destination.glob(glob_str))
-    if len(potential_matches) > 0:
-        match_file: Path = potential_matches[0]
-        if match_file.is_dir():
-            return True
-    return False
+    return S_ISDIR(_probe(str(destination), os.path.relpath(file_to_check, source)))
 
 
 def is_file_in_other(file_to_check: Path, source: Path, destination: Path) -> bool:
@@ -272,69 +626,151 @@ def is_file_in_other(file_to_check: Path, source: Path, destination: Path) -> bo
         destination (pathlib.Path): path of the destination folder
 
     Returns:
-        bool: True if the file is found in the destination False otherwise
-    Raises:
-        ExpectedFileIsAFolder custom exception if the file is found but it's a folder
+        bool: True if the file is found in the destination and is a file. False otherwise
     """
-    glob_str: str = file_to_check.as_posix().replace(source.as_posix(), "").lstrip("/")
-    potential_matches = list(destination.glob(glob_str))
-    if len(potential_matches) > 0:
-        match_file: Path = potential_matches[0]
-        if match_file.is_file():
-            return True
-        else:
-            raise ExpectedFileIsAFolder(f"Expected {match_file.as_posix()} to be a file but it's a folder.")
-    return False
-
+    return S_ISREG(_probe(str(destination), os.path.relpath(file_to_check, source)))
 
-class ExpectedFileIsAFolder(Exception):
-    pass
 
-
-def is_file_in_other_modified(file_to_check: Path, source: Path, destination: Path) -> bool:
+def is_file_in_other_modified(
+    file_to_check: Path, source: Path, destination: Path, source_stat: os.stat_result | None = None
+) -> bool:
     """Check if file_to_check is in destination folder and it's the same file.
     Given there is a file with the same name in the destination folder (same relative path)
-    assume if modification times are the same the files are the same.
-    If the modifications time are different compare the files' content using md5.
+    assume if sizes differ the files are different and if sizes and modification times are the same the files are the same.
+    If the modifications time are different compare the files' contents.
 
     Args:
         file_to_check (pathlib.Path): path of the file to check from the source folder
         source (pathlib.Path): path of the source folder
         destination (pathlib.Path): path of the destination folder
+        source_stat (os.stat_result | None): already known stat of file_to_check (e.g. from os.scandir), stat is called if None
 
     Returns:
-        bool: False of the file is found in the destination at the same relative path and either
-        the modification times are the same or the md5 hash of the contents are the same. True otherwise
+        bool: False of the file is found in the destination at the same relative path, has the same size and either
+        the modification times or the contents are the same. True otherwise
     Raises:
         FileNotFoundError if the file is not found in the destination folder
     """
-    glob_str: str = file_to_check.as_posix().replace(source.as_posix(), "").lstrip("/")
-    potential_matches = list(destination.glob(glob_str))
-    if len(potential_matches) > 0:
-        match_file: Path = potential_matches[0]
-        destination_mdate: float = match_file.stat().st_mtime
-        source_mdate: float = file_to_check.stat().st_mtime
-        if source_mdate == destination_mdate:
-            return False
-        source_hash: str = compute_hash(file_to_check)
-        destination_hash: str = compute_hash(match_file)
-        if source_hash == destination_hash:
-            return False
-    else:
-        raise FileNotFoundError
-    return True
+    source_file: str = os.fspath(file_to_check)
+    match_file: str = os.path.join(destination, os.path.relpath(source_file, source))
+    destination_entry: SnapshotEntry = _snapshot_entry(os.lstat(match_file))
+    if source_stat is None:
+        source_stat = os.stat(source_file)
+    return is_modified(source_file, source_stat, match_file, destination_entry)
+
+
+def is_modified(
+    source_file: str | Path, source_stat: os.stat_result, destination_file: str | Path, destination_entry: SnapshotEntry
+) -> bool:
+    """Compare two files whose stats are already known.
+    Files with different sizes are different, files with the same size and modification time are the same,
+    otherwise the files' contents are compared.
+    If the contents are the same the destination modification time is set to the source one
+    so the next comparison doesn't need to read the files again.
+
+    Args:
+        source_file (str | pathlib.Path): path of the file from the source folder
+        source_stat (os.stat_result): stat of source_file
+        destination_file (str | pathlib.Path): path of the file from the destination folder
+        destination_entry (SnapshotEntry): (mode, size, mtime_ns) of destination_file
+
+    Returns:
+        bool: False if the sizes are the same and either the modification times or the contents are the same.
+        True otherwise
+    """
+    if source_stat.st_size != destination_entry[1]:
+        return True
+    if source_stat.st_mtime_ns == destination_entry[2]:
+        return False
+    if not _content_equal(source_file, destination_file):
+        return True
+    os.utime(destination_file, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+    return False
 
 
-def compute_hash(file_to_check: Path) -> str:
-    hash = md5()
-    with file_to_check.open("rb") as f:
-        chunk: bytes = f.read(4096)
-        while chunk:
-            hash.update(chunk)
-            chunk = f.read(4096)
+def fast_copy(source_file: str, destination_file: str, source_stat: os.stat_result) -> str:
+    """Copy a file letting the kernel move the data and replicate its permission bits and times.
+    Uses CopyFileExW on Windows, os.copy_file_range (reflinks on filesystems supporting them) elsewhere
+    and falls back to shutil.copyfile (os.sendfile on Linux) if it's not available or not supported for these files.
+
+    Args:
+        source_file (str): path of the file to copy
+        destination_file (str): path of the copy
+        source_stat (os.stat_result): already known stat of source_file (e.g. from os.scandir)
+
+    Returns:
+        str: destination_file
+    """
+    copied: bool = False
+    if sys.platform == "win32":  # pragma: no cover
+        if not _copy_file_ex(source_file, destination_file, None, None, None, 0):
+            raise ctypes.WinError(ctypes.get_last_error())
+        copied = True
+    elif hasattr(os, "copy_file_range"):
+        try:
+            with open(source_file, "rb") as fsrc, open(destination_file, "wb") as fdst:
+                while os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_BLOCK_SIZE):
+                    pass
+            copied = True
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ETXTBSY):
+                raise
+    if not copied:
+        copyfile(source_file, destination_file)
+    os.chmod(destination_file, S_IMODE(source_stat.st_mode))
+    os.utime(destination_file, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+    return destination_file
+
+
+def _content_equal(file1: str | Path, file2: str | Path) -> bool:
+    """Return True if two files of the same size have the same content.
+    Both files are read side by side and their blocks compared, which stops at the first different block.
+    Nothing is cached, the answer always comes from the current content.
+    """
+    with open(file1, "rb", buffering=0) as f1, open(file2, "rb", buffering=0) as f2:
+        while True:
+            block: bytes = f1.read(COMPARE_BLOCK_SIZE)
+            if block != f2.read(COMPARE_BLOCK_SIZE):
+                return False
+            if not block:
+                return True
+
+
+def compute_hash(file_to_check: str | Path) -> str:
+    """Compute the hash of a file's content using BLAKE3 if available, BLAKE2b otherwise.
+    It doesn't need to be cryptographic, the hash only identifies the content.
+
+    Args:
+        file_to_check (str | pathlib.Path): path of the file to hash
+
+    Returns:
+        str: hex digest of the file's content
+    """
+    hash = _hasher()
+    if HASHER_READS_FILES:
+        # blake3 reads (memory maps) the file itself without holding the GIL
+        hash.update_mmap(file_to_check)
+        return hash.hexdigest()
+    with open(file_to_check, "rb", buffering=0) as f:
+        if 0 < os.fstat(f.fileno()).st_size < MMAP_HASH_LIMIT:
+            # a single update over the mapped file, hashlib releases the GIL while hashing it
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                hash.update(mapped)
+            return hash.hexdigest()
+        view: memoryview = _hash_buffer()
+        while size := f.readinto(view):
+            hash.update(view[:size])
     return hash.hexdigest()
 
 
+def _hash_buffer() -> memoryview:
+    """Return the HASH_BUFFER_SIZE read buffer of the current thread, allocating it on first use."""
+    view: memoryview | None = getattr(_thread_local, "hash_buffer", None)
+    if view is None:
+        view = _thread_local.hash_buffer = memoryview(bytearray(HASH_BUFFER_SIZE))
+    return view
+
+
 def validate_source(path: Path) -> bool:
     """Validate source folder
 
@@ -348,12 +784,11 @@ def validate_source(path: Path) -> bool:
         SystemExit: path does not exist
         SystemExit: path is not a folder
     """
-    _logger: logging.Logger = logging.getLogger(__name__)
     if not path.exists():
-        _logger.error("SOURCE folder: %s doesn't exist" % path.as_posix())
+        _logger.error("SOURCE folder: %s doesn't exist", path.as_posix())
         raise SystemExit(1)
     if not path.is_dir():
-        _logger.error("SOURCE: %s is not a folder" % path.as_posix())
+        _logger.error("SOURCE: %s is not a folder", path.as_posix())
         raise SystemExit(1)
     return True
 
@@ -374,21 +809,21 @@ def validate_replica(path: Path) -> bool:
         SystemExit: path is not a folder
         SystemExit: could not create replica folder
     """
-    _logger: logging.Logger = logging.getLogger(__name__)
     if not path.exists():
         try:
             path.mkdir(parents=True)
         except PermissionError:
-            _logger.error("Permission denied trying to create REPLICA folder: %s" % path.as_posix())
+            _logger.error("Permission denied trying to create REPLICA folder: %s", path.as_posix())
             raise SystemExit()
     if not path.is_dir():
-        _logger.error("REPLICA: %s is not a folder" % path.as_posix())
+        _logger.error("REPLICA: %s is not a folder", path.as_posix())
         raise SystemExit(1)
     return True
 
 
 def setup_logging(loglevel: LOGLEVEL, logfile: str | Path) -> None:
     """Setup logging
+    Replaces the handlers added by a previous call.
 
     Args:
       loglevel (logging._Level): minimum loglevel for emitting messages
@@ -396,7 +831,6 @@ def setup_logging(loglevel: LOGLEVEL, logfile: str | Path) -> None:
     Returns:
         None
     """
-    _logger: logging.Logger = logging.getLogger(__name__)
     loglevels: dict[str, int] = {
         "debug": logging.DEBUG,
         "info": logging.INFO,
@@ -405,18 +839,22 @@ def setup_logging(loglevel: LOGLEVEL, logfile: str | Path) -> None:
         "critical": logging.CRITICAL,
     }
     _logger.setLevel(loglevels[loglevel])
-    logformat = "[%(asctime)s.%(msecs)03d] %(levelname)s:%(name)s:- %(message)s"
-    formatter = logging.Formatter(fmt=logformat, datefmt="%Y-%m-%d %H:%M:%S")
 
     # setup file logging
     fh = logging.FileHandler(logfile, encoding="utf-8", errors="replace")
     fh.setLevel(loglevels[loglevel])
-    fh.setFormatter(formatter)
+    fh.setFormatter(_formatter)
 
     # setup console logging
     ch = logging.StreamHandler()  # type: ignore
     ch.setLevel(loglevels[loglevel])
-    ch.setFormatter(formatter)
+    ch.setFormatter(_formatter)
+
+    # replace the handlers of a previous call so messages are not emitted more than once
+    for handler in list(_logger.handlers):
+        _logger.removeHandler(handler)
+        handler.close()
+    _logger.propagate = False
 
     _logger.addHandler(fh)
     _logger.addHandler(ch)
@@ -439,6 +877,12 @@ def setup_logging(loglevel: LOGLEVEL, logfile: str | Path) -> None:
     default="info",
     help="Default = info",
 )
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=DEFAULT_WORKERS,
+    help="Number of threads copying and comparing files. Default = min(32, 4 * CPU count)",
+)
 @click.version_option()
 @click.help_option("-h", "--help")
 def main(
@@ -447,11 +891,12 @@ def main(
     syncinterval: int,
     logfile: Path,
     loglevel: LOGLEVEL,
+    workers: int,
     # loglevel: Literal["debug", "info", "warn", "error", "critical"],
 ) -> None:
     """Main entrypoint"""
 
-    sync_folder(source, replica, syncinterval, logfile, loglevel)
+    sync_folder(source, replica, syncinterval, logfile, loglevel, workers)
 
 
 if __name__ == "__main__":
@@ -1,25 +1,37 @@
+import logging
+import os
 import random
 import string
+import sys
+from collections.abc import Callable, Iterable
 from datetime import datetime, timedelta
-from hashlib import md5
+from hashlib import blake2b
 from os import utime
 from pathlib import Path
 from shutil import copy2
+from stat import S_IFDIR, S_IFLNK, S_IFREG, S_ISDIR
+from typing import Any
 
 import pytest
 
+from folder_syncv import syncv
 from folder_syncv.syncv import (
-    ExpectedFileIsAFolder,
+    ReplicaStatus,
+    SnapshotEntry,
+    _snapshot,
     compute_hash,
+    fast_copy,
     is_file_in_other,
     is_file_in_other_as_folder,
     is_file_in_other_modified,
     is_folder_in_other_as_file,
     is_folder_in_other_as_folder,
+    replica_status,
     setup_logging,
     sync_folder,
     sync_replica_to_source,
     sync_source_to_replica,
+    sync_trees,
 )
 
 __author__ = "George Murga"
@@ -27,18 +39,44 @@ __copyright__ = "George Murga"
 __license__ = "MIT"
 
 
+@pytest.fixture(params=["blake3", "blake2b"])
+def hasher(request: pytest.FixtureRequest, monkeypatch: pytest.MonkeyPatch) -> Callable[..., Any]:
+    """Run the test with blake3 (skipped if it's not installed) and with the hashlib fallback."""
+    if request.param == "blake3":
+        if not syncv.HASHER_READS_FILES:
+            pytest.skip("blake3 is not installed")
+    else:
+        monkeypatch.setattr(syncv, "_hasher", blake2b)
+        monkeypatch.setattr(syncv, "HASHER_READS_FILES", False)
+    return syncv._hasher
+
+
 def create_random_string(length: int) -> str:
     return "".join(random.choice(string.printable) for i in range(length))
 
 
+def relative_posix_paths(folder: Path, paths: Iterable[Path]) -> set[str]:
+    prefix_len: int = len(folder.as_posix())
+    return {x.as_posix()[prefix_len:] for x in paths}
+
+
 def test_setup_logging_logfile_parent_doesnt_exist(tmp_path: Path) -> None:
     with pytest.raises(FileNotFoundError):
         setup_logging(loglevel="debug", logfile=tmp_path / "subpath1/syncv.log")
 
 
-def test_compute_hash_non_empty_file(tmp_path: Path) -> None:
+def test_setup_logging_twice_doesnt_duplicate_handlers(tmp_path: Path) -> None:
+    setup_logging(loglevel="debug", logfile=tmp_path / "syncv1.log")
+    setup_logging(loglevel="info", logfile=tmp_path / "syncv2.log")
+    logger: logging.Logger = logging.getLogger("folder_syncv.syncv")
+    assert len(logger.handlers) == 2
+    assert logger.propagate is False
+    assert [Path(h.baseFilename) for h in logger.handlers if isinstance(h, logging.FileHandler)] == [tmp_path / "syncv2.log"]
+
+
+def test_compute_hash_non_empty_file(tmp_path: Path, hasher: Callable[..., Any]) -> None:
     s: str = create_random_string(10_000)
-    valid_hash: str = md5(s.encode(encoding="utf-8")).hexdigest()
+    valid_hash: str = hasher(s.encode(encoding="utf-8")).hexdigest()
     temp_file: Path = tmp_path / "tmp.txt"
     with temp_file.open("w", encoding="utf-8") as f:
         f.write(s)
@@ -46,9 +84,9 @@ def test_compute_hash_non_empty_file(tmp_path: Path) -> None:
     assert computed_hash == valid_hash
 
 
-def test_compute_hash_empty_file(tmp_path: Path) -> None:
+def test_compute_hash_empty_file(tmp_path: Path, hasher: Callable[..., Any]) -> None:
     s: str = ""
-    valid_hash: str = md5(s.encode(encoding="utf-8")).hexdigest()
+    valid_hash: str = hasher(s.encode(encoding="utf-8")).hexdigest()
     temp_file: Path = tmp_path / "tmp.txt"
     with temp_file.open("w", encoding="utf-8") as f:
         f.write(s)
@@ -56,6 +94,62 @@ def test_compute_hash_empty_file(tmp_path: Path) -> None:
     assert computed_hash == valid_hash
 
 
+def test_compute_hash_file_changed(tmp_path: Path, hasher: Callable[..., Any]) -> None:
+    temp_file: Path = tmp_path / "tmp.bin"
+    temp_file.write_bytes(b"12345")
+    utime(temp_file, ns=(1_000_000_000, 1_000_000_000))
+    assert compute_hash(temp_file) == hasher(b"12345").hexdigest()
+    temp_file.write_bytes(b"54321")
+    # same size and modification time, as left by cp -p or rsync -t
+    utime(temp_file, ns=(1_000_000_000, 1_000_000_000))
+    assert compute_hash(temp_file) == hasher(b"54321").hexdigest()
+
+
+def test_compute_hash_file_not_mapped(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    data: bytes = os.urandom(10_000)
+    temp_file: Path = tmp_path / "tmp.bin"
+    temp_file.write_bytes(data)
+    monkeypatch.setattr(syncv, "_hasher", blake2b)
+    monkeypatch.setattr(syncv, "HASHER_READS_FILES", False)
+    mapped_hash: str = compute_hash(temp_file)
+    monkeypatch.setattr(syncv, "MMAP_HASH_LIMIT", 1_000)
+    monkeypatch.setattr(syncv, "HASH_BUFFER_SIZE", 4_096)
+    monkeypatch.setattr(syncv._thread_local, "hash_buffer", None, raising=False)
+    assert compute_hash(temp_file) == mapped_hash == blake2b(data).hexdigest()
+
+
+def test_fast_copy(tmp_path: Path) -> None:
+    s: str = create_random_string(10_000)
+    source_file: Path = tmp_path / "source.txt"
+    with source_file.open("w", encoding="utf-8") as f:
+        f.write(s)
+    source_file.chmod(0o640)
+    utime(source_file, (0, 0))
+    destination_file: Path = tmp_path / "destination.txt"
+
+    assert fast_copy(str(source_file), str(destination_file), source_file.stat()) == str(destination_file)
+    assert destination_file.read_bytes() == source_file.read_bytes()
+    assert destination_file.stat().st_mtime_ns == source_file.stat().st_mtime_ns
+    assert destination_file.stat().st_mode == source_file.stat().st_mode
+
+
+@pytest.mark.skipif(sys.platform != "win32", reason="CopyFileExW is only used on Windows")
+def test_fast_copy_copy_file_ex(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    def fail_copyfile(*args, **kwargs):
+        raise AssertionError("CopyFileExW should copy the file")
+
+    monkeypatch.setattr(syncv, "copyfile", fail_copyfile)
+    source_file: Path = tmp_path / "source.bin"
+    source_file.write_bytes(os.urandom(10_000))
+    utime(source_file, (0, 0))
+    destination_file: Path = tmp_path / "destination.bin"
+    destination_file.write_bytes(b"older content")
+
+    assert fast_copy(str(source_file), str(destination_file), source_file.stat()) == str(destination_file)
+    assert destination_file.read_bytes() == source_file.read_bytes()
+    assert destination_file.stat().st_mtime_ns == source_file.stat().st_mtime_ns
+
+
 def test_is_file_in_other_modified_file_not_in_other(tmp_path: Path) -> None:
     source_path: Path = tmp_path / "source"
     source_path.mkdir(parents=True)
@@ -85,8 +179,8 @@ def test_is_file_in_other_modified_file_in_other_same_mtime(tmp_path: Path) -> N
         f.write("")
 
     destination_file: Path = Path(copy2(source_file, destination_file_path))
-    # print(f" {source_file.stat().st_mtime=} - {destination_file.stat().st_mtime=}")
-    assert source_file.stat().st_mtime == destination_file.stat().st_mtime
+    # print(f" {source_file.stat().st_mtime_ns=} - {destination_file.stat().st_mtime_ns=}")
+    assert source_file.stat().st_mtime_ns == destination_file.stat().st_mtime_ns
     assert is_file_in_other_modified(source_file, source_path, destination_path) is False
 
 
@@ -114,9 +208,41 @@ def test_is_file_in_other_modified_file_in_other_different_mtime_same_content(
             (timedelta(days=1) + datetime.today()).timestamp(),
         ),
     )
-    # print(f" {source_file.stat().st_mtime=} - {destination_file.stat().st_mtime=}")
-    assert source_file.stat().st_mtime != destination_file.stat().st_mtime
+    # print(f" {source_file.stat().st_mtime_ns=} - {destination_file.stat().st_mtime_ns=}")
+    assert source_file.stat().st_mtime_ns != destination_file.stat().st_mtime_ns
+    assert is_file_in_other_modified(source_file, source_path, destination_path) is False
+
+
+def test_is_file_in_other_modified_same_content_updates_destination_mtime(tmp_path: Path) -> None:
+    source_path: Path = tmp_path / "source"
+    source_path.mkdir(parents=True)
+    destination_path: Path = tmp_path / "destination"
+    destination_path.mkdir(parents=True)
+    source_file: Path = source_path / "dummy.txt"
+    with source_file.open("w", encoding="utf-8") as f:
+        f.write(create_random_string(100))
+    destination_file: Path = Path(copy2(source_file, destination_path))
+    utime(destination_file, (0, 0))
+
     assert is_file_in_other_modified(source_file, source_path, destination_path) is False
+    assert destination_file.stat().st_mtime_ns == source_file.stat().st_mtime_ns
+
+
+def test_is_file_in_other_modified_same_mtime_different_size(tmp_path: Path) -> None:
+    source_path: Path = tmp_path / "source"
+    source_path.mkdir(parents=True)
+    destination_path: Path = tmp_path / "destination"
+    destination_path.mkdir(parents=True)
+    source_file: Path = source_path / "dummy.txt"
+    with source_file.open("w", encoding="utf-8") as f:
+        f.write(create_random_string(100))
+    destination_file: Path = destination_path / "dummy.txt"
+    with destination_file.open("w", encoding="utf-8") as f:
+        f.write(create_random_string(50))
+    source_stat = source_file.stat()
+    utime(destination_file, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+
+    assert is_file_in_other_modified(source_file, source_path, destination_path) is True
 
 
 def test_is_file_in_other_modified_file_in_other_different_mtime_different_content(
@@ -146,11 +272,29 @@ def test_is_file_in_other_modified_file_in_other_different_mtime_different_conte
             (timedelta(days=1) + datetime.today()).timestamp(),
         ),
     )
-    # print(f" {source_file.stat().st_mtime=} - {destination_file.stat().st_mtime=}")
-    assert source_file.stat().st_mtime != destination_file.stat().st_mtime
+    # print(f" {source_file.stat().st_mtime_ns=} - {destination_file.stat().st_mtime_ns=}")
+    assert source_file.stat().st_mtime_ns != destination_file.stat().st_mtime_ns
     assert is_file_in_other_modified(source_file, source_path, destination_path) is True
 
 
+def test_is_file_in_other_modified_different_size_doesnt_read_files(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    source_path: Path = tmp_path / "source"
+    source_path.mkdir(parents=True)
+    destination_path: Path = tmp_path / "destination"
+    destination_path.mkdir(parents=True)
+    with (source_path / "dummy.txt").open("w", encoding="utf-8") as f:
+        f.write(create_random_string(100))
+    with (destination_path / "dummy.txt").open("w", encoding="utf-8") as f:
+        f.write(create_random_string(50))
+    utime(destination_path / "dummy.txt", (0, 0))
+
+    def fail_content_equal(file1: Path, file2: Path) -> bool:
+        raise AssertionError(f"{file1} and {file2} should not be read")
+
+    monkeypatch.setattr(syncv, "_content_equal", fail_content_equal)
+    assert is_file_in_other_modified(source_path / "dummy.txt", source_path, destination_path) is True
+
+
 def test_is_file_in_other_not_in_ohter(tmp_path: Path) -> None:
     source_path: Path = tmp_path / "source"
     source_path.mkdir(parents=True)
@@ -183,8 +327,7 @@ def test_is_file_in_other_in_ohter_as_folder(tmp_path: Path) -> None:
     destination_path: Path = tmp_path / "destination"
     destination_folder: Path = destination_path / "test.txt"
     destination_folder.mkdir(parents=True)
-    with pytest.raises(ExpectedFileIsAFolder):
-        is_file_in_other(source_file, source_path, destination_path)
+    assert is_file_in_other(source_file, source_path, destination_path) is False
 
 
 def test_is_file_in_other_as_folder_not_in_ohter(tmp_path: Path) -> None:
@@ -285,6 +428,19 @@ def test_is_folder_in_other_as_folder_is_in_other_as_folder(tmp_path: Path) -> N
     assert is_folder_in_other_as_folder(source_folder_path, source_path, destination_path) is True
 
 
+def test_is_folder_in_other_as_folder_parent_in_other_as_file(tmp_path: Path) -> None:
+    source_path: Path = tmp_path / "source"
+    source_folder_path: Path = source_path / "level1/level2/level3"
+    source_folder_path.mkdir(parents=True)
+
+    destination_path: Path = tmp_path / "destination"
+    destination_path.mkdir(parents=True)
+    (destination_path / "level1").touch()
+
+    assert is_folder_in_other_as_folder(source_folder_path, source_path, destination_path) is False
+    assert is_folder_in_other_as_file(source_folder_path, source_path, destination_path) is False
+
+
 def test_is_folder_in_other_as_folder_is_in_other_as_file(tmp_path: Path) -> None:
     source_path: Path = tmp_path / "source"
     source_folder_path: Path = source_path / "level1/level2/level3"
@@ -300,6 +456,62 @@ def test_is_folder_in_other_as_folder_is_in_other_as_file(tmp_path: Path) -> Non
     assert is_folder_in_other_as_folder(source_folder_path, source_path, destination_path) is False
 
 
+def test_sync_trees_deleted_and_replaced_folders_content(tmp_path: Path) -> None:
+    source: Path = tmp_path / "source"
+    replica: Path = tmp_path / "replica"
+    source.mkdir()
+    (source / "replaced").write_text("now a file", encoding="utf-8")
+    kept: Path = tmp_path / "kept"
+    kept.mkdir()
+    (kept / "file.txt").touch()
+    for folder in (replica / "folder", replica / "replaced"):
+        (folder / "l1/l11/l111").mkdir(parents=True)
+        (folder / "l1/l11/file11.txt").touch()
+        (folder / "file0.txt").touch()
+        (folder / "link").symlink_to(kept)
+
+    result: tuple[int, ...] = sync_trees(source, replica)
+    assert result[2:] == (1, 0, 0, 0, 2)
+    assert sorted(os.listdir(replica)) == ["replaced"]
+    assert (replica / "replaced").read_text(encoding="utf-8") == "now a file"
+    assert (kept / "file.txt").exists()
+
+
+def test_snapshot(tmp_path: Path) -> None:
+    (tmp_path / "l1/l11").mkdir(parents=True)
+    with (tmp_path / "l1/file1.txt").open("w", encoding="utf-8") as f:
+        f.write("12345")
+
+    snapshot: dict[str, SnapshotEntry] = _snapshot(str(tmp_path))
+    assert set(snapshot) == {"l1", os.path.join("l1", "l11"), os.path.join("l1", "file1.txt")}
+    file_stat = (tmp_path / "l1/file1.txt").stat()
+    assert snapshot[os.path.join("l1", "file1.txt")] == (file_stat.st_mode, 5, file_stat.st_mtime_ns)
+    assert S_ISDIR(snapshot["l1"][0])
+
+
+def test_snapshot_stats(tmp_path: Path) -> None:
+    file: Path = tmp_path / "l1/file.txt"
+    file.parent.mkdir()
+    file.touch()
+    stats: dict[str, os.stat_result] = {}
+    _snapshot(str(tmp_path), stats)
+    assert list(stats) == [str(file)]
+    assert stats[str(file)].st_ino == file.stat().st_ino
+
+
+def test_replica_status() -> None:
+    folder: SnapshotEntry = (S_IFDIR | 0o755, 4096, 1_000)
+    file: SnapshotEntry = (S_IFREG | 0o644, 100, 1_000)
+    assert replica_status(folder, folder) is ReplicaStatus.SAME
+    assert replica_status(folder, file) is ReplicaStatus.FOLDER_IS_A_FILE
+    assert replica_status(file, None) is ReplicaStatus.MISSING
+    assert replica_status(file, folder) is ReplicaStatus.FILE_IS_A_FOLDER
+    assert replica_status(file, file) is ReplicaStatus.SAME
+    assert replica_status(file, (S_IFREG | 0o644, 50, 1_000)) is ReplicaStatus.MODIFIED
+    assert replica_status(file, (S_IFREG | 0o644, 100, 2_000)) is ReplicaStatus.MODIFIED
+    assert replica_status(file, (S_IFLNK | 0o777, 100, 1_000)) is ReplicaStatus.OTHER_TYPE
+
+
 def test_sync_source_to_replica_empty_replica(tmp_path: Path) -> None:
     source: Path = tmp_path / "source"
     l1: Path = source / "l1/l11/l111"
@@ -326,8 +538,8 @@ def test_sync_source_to_replica_empty_replica(tmp_path: Path) -> None:
     assert files_updated == 0
     assert folders_copied == 3
     assert folders_deleted == 0
-    source_files_and_folders: set[str] = set(x.as_posix().replace(source.as_posix(), "") for x in source.iterdir())
-    destination_files_and_folders: set[str] = set(x.as_posix().replace(destination.as_posix(), "") for x in destination.iterdir())
+    source_files_and_folders: set[str] = relative_posix_paths(source, source.iterdir())
+    destination_files_and_folders: set[str] = relative_posix_paths(destination, destination.iterdir())
     assert source_files_and_folders == destination_files_and_folders
 
 
@@ -374,8 +586,8 @@ def test_sync_source_to_replica_nonempty_replica(tmp_path: Path) -> None:
     assert files_updated == 0
     assert folders_copied == 2
     assert folders_deleted == 1
-    source_files_and_folders: set[str] = set(x.as_posix().replace(source.as_posix(), "") for x in source.rglob("*"))
-    destination_files_and_folders: set[str] = set(x.as_posix().replace(destination.as_posix(), "") for x in destination.rglob("*"))
+    source_files_and_folders: set[str] = relative_posix_paths(source, source.rglob("*"))
+    destination_files_and_folders: set[str] = relative_posix_paths(destination, destination.rglob("*"))
 
     print(f"{source_files_and_folders=}")
     print(f"{destination_files_and_folders=}")
@@ -423,13 +635,65 @@ def test_sync_replica_to_source_empty_replica(tmp_path: Path) -> None:
     files_deleted, folders_deleted = sync_replica_to_source(source, destination)
     assert files_deleted == 1
     assert folders_deleted == 1
-    # source_files_and_folders: set[str] = set(x.as_posix().replace(source.as_posix(), "") for x in source.rglob("*"))
-    destination_files_and_folders: set[str] = set(x.as_posix().replace(destination.as_posix(), "") for x in destination.rglob("*"))
+    # source_files_and_folders: set[str] = relative_posix_paths(source, source.rglob("*"))
+    destination_files_and_folders: set[str] = relative_posix_paths(destination, destination.rglob("*"))
 
     print(f"{destination_files_and_folders=}")
     assert destination_files_and_folders == {"/l1"}
 
 
+def test_sync_replica_to_source_nested_extras(tmp_path: Path) -> None:
+    source: Path = tmp_path / "source"
+    (source / "l1/l11").mkdir(parents=True)
+    (source / "l1/file1.txt").touch()
+
+    destination: Path = tmp_path / "destination"
+    (destination / "l1/l11/extra_folder").mkdir(parents=True)
+    (destination / "l1/file1.txt").touch()
+    (destination / "l1/l11/extra_file.txt").touch()
+
+    files_deleted, folders_deleted = sync_replica_to_source(source, destination)
+    assert files_deleted == 1
+    assert folders_deleted == 1
+    destination_files_and_folders: set[str] = relative_posix_paths(destination, destination.rglob("*"))
+    assert destination_files_and_folders == {"/l1", "/l1/l11", "/l1/file1.txt"}
+
+
+def test_sync_trees(tmp_path: Path) -> None:
+    source: Path = tmp_path / "source"
+    (source / "l1/l11").mkdir(parents=True)
+    (source / "l1/file1.txt").touch()
+    (source / "l2").mkdir(parents=True)
+    (source / "l2/file2.txt").touch()
+    (source / "file0.txt").touch()
+    with (source / "modified.txt").open("w", encoding="utf-8") as f:
+        f.write(create_random_string(100))
+
+    destination: Path = tmp_path / "destination"
+    (destination / "l1/d11").mkdir(parents=True)
+    (destination / "l1/d11/d_file11.txt").touch()
+    (destination / "l1/l11").touch()
+    (destination / "file0.txt").mkdir(parents=True)
+    (destination / "d_file.txt").touch()
+    with (destination / "modified.txt").open("w", encoding="utf-8") as f:
+        f.write(create_random_string(100))
+
+    (files_count, folders_count, files_copied, files_updated, folders_copied, files_deleted, folders_deleted) = sync_trees(
+        source, destination, workers=2
+    )
+    assert files_count == 3
+    assert folders_count == 3
+    assert files_copied == 2
+    assert files_updated == 1
+    assert folders_copied == 2
+    assert files_deleted == 1
+    assert folders_deleted == 2
+    source_files_and_folders: set[str] = relative_posix_paths(source, source.rglob("*"))
+    destination_files_and_folders: set[str] = relative_posix_paths(destination, destination.rglob("*"))
+    assert destination_files_and_folders == source_files_and_folders
+    assert (destination / "modified.txt").read_bytes() == (source / "modified.txt").read_bytes()
+
+
 def test_sync_folder(tmp_path: Path) -> None:
     source: Path = tmp_path / "source"
     l1: Path = source / "l1/l11/l111"
@@ -465,10 +729,96 @@ def test_sync_folder(tmp_path: Path) -> None:
 
     sync_folder(source, destination, 0, tmp_path / "tmp.log", "debug")
 
-    source_files_and_folders: set[str] = set(x.as_posix().replace(source.as_posix(), "") for x in source.rglob("*"))
-    destination_files_and_folders: set[str] = set(x.as_posix().replace(destination.as_posix(), "") for x in destination.rglob("*"))
+    source_files_and_folders: set[str] = relative_posix_paths(source, source.rglob("*"))
+    destination_files_and_folders: set[str] = relative_posix_paths(destination, destination.rglob("*"))
 
     print(f"{source_files_and_folders=}")
     print(f"{destination_files_and_folders=}")
     print(f"{destination_files_and_folders - source_files_and_folders=}")
     assert destination_files_and_folders == source_files_and_folders
+
+
+def test_sync_trees_deep_folder(tmp_path: Path) -> None:
+    source: Path = tmp_path / "source"
+    deepest: Path = source.joinpath(*["d"] * 600)
+    deepest.mkdir(parents=True)
+    (deepest / "file.txt").write_text("12345", encoding="utf-8")
+    destination: Path = tmp_path / "destination"
+    destination.mkdir()
+
+    assert sync_trees(source, destination, workers=2) == (0, 1, 0, 0, 1, 0, 0)
+    assert (destination / deepest.relative_to(source) / "file.txt").read_text(encoding="utf-8") == "12345"
+    assert sync_trees(source, destination, workers=2) == (1, 600, 0, 0, 0, 0, 0)
+
+
+def test_sync_trees_in_sync_replica_stats_only_in_scan(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    source: Path = tmp_path / "source"
+    (source / "l1/l11").mkdir(parents=True)
+    (source / "l1/file1.txt").write_text("12345", encoding="utf-8")
+    (source / "file0.txt").touch()
+    destination: Path = tmp_path / "destination"
+    destination.mkdir()
+    sync_trees(source, destination, workers=2)
+
+    # _snapshot stats with DirEntry.stat, which doesn't go through os.stat / os.lstat: only calls after the scan fail
+    def fail(*args, **kwargs):
+        raise AssertionError("paths should not be stat'ed again after the scan")
+
+    monkeypatch.setattr(os, "stat", fail)
+    monkeypatch.setattr(os, "lstat", fail)
+    assert sync_trees(source, destination, workers=2) == (2, 2, 0, 0, 0, 0, 0)
+
+
+def test_sync_trees_symlinks(tmp_path: Path) -> None:
+    (tmp_path / "target.txt").write_text("12345", encoding="utf-8")
+    source: Path = tmp_path / "source"
+    (source / "l1").mkdir(parents=True)
+    (source / "file0.txt").touch()
+    (source / "toplink.txt").symlink_to("../target.txt")
+    (source / "loop").symlink_to(".")
+    destination: Path = tmp_path / "destination"
+    destination.mkdir()
+    # left by a version which followed symlinks
+    (destination / "toplink.txt").write_text("12345", encoding="utf-8")
+
+    assert sync_trees(source, destination, workers=2) == (3, 1, 3, 0, 1, 0, 0)
+    assert os.readlink(destination / "toplink.txt") == "../target.txt"
+    assert os.readlink(destination / "loop") == "."
+    assert sync_trees(source, destination, workers=2) == (3, 1, 0, 0, 0, 0, 0)
+    assert relative_posix_paths(source, source.iterdir()) == relative_posix_paths(destination, destination.iterdir())
+
+
+def test_sync_trees_symlinks_in_copied_folder(tmp_path: Path) -> None:
+    (tmp_path / "target.txt").write_text("12345", encoding="utf-8")
+    source: Path = tmp_path / "source"
+    (source / "new").mkdir(parents=True)
+    (source / "new/link.txt").symlink_to("../../target.txt")
+    (source / "new/up").symlink_to("..")
+    destination: Path = tmp_path / "destination"
+    destination.mkdir()
+
+    assert sync_trees(source, destination, workers=2) == (0, 1, 0, 0, 1, 0, 0)
+    assert os.readlink(destination / "new/link.txt") == "../../target.txt"
+    assert os.readlink(destination / "new/up") == ".."
+    assert sync_trees(source, destination, workers=2) == (2, 1, 0, 0, 0, 0, 0)
+
+
+def test_sync_trees_replica_rewritten_same_size_and_mtime(tmp_path: Path) -> None:
+    source: Path = tmp_path / "source"
+    source.mkdir()
+    (source / "file.txt").write_bytes(b"AAAA")
+    utime(source / "file.txt", ns=(2_000_000_000, 2_000_000_000))
+    destination: Path = tmp_path / "destination"
+    destination.mkdir()
+    (destination / "file.txt").write_bytes(b"AAAA")
+    utime(destination / "file.txt", ns=(1_000_000_000, 1_000_000_000))
+
+    # same content, only the replica modification time is updated
+    assert sync_trees(source, destination, workers=2) == (1, 0, 0, 0, 0, 0, 0)
+    assert (destination / "file.txt").stat().st_mtime_ns == 2_000_000_000
+
+    # rewritten with the same size and the older modification time put back (e.g. cp -p, rsync -t)
+    (destination / "file.txt").write_bytes(b"BBBB")
+    utime(destination / "file.txt", ns=(1_000_000_000, 1_000_000_000))
+    assert sync_trees(source, destination, workers=2) == (1, 0, 0, 1, 0, 0, 0)
+    assert (destination / "file.txt").read_bytes() == b"AAAA"